@@ -87,7 +87,7 @@ from .signer import (sign_v4, presign_v4,
                      post_presign_signature)
 from .signer import (_UNSIGNED_PAYLOAD, _SIGN_V4_ALGORITHM)
 from .xml_marshal import (xml_marshal_bucket_constraint,
-                          xml_marshal_complete_multipart_upload,
+                          xml_marshal_complete_multipart_upload_etags,
                           xml_marshal_bucket_notifications,
                           xml_marshal_delete_objects,
                           xml_marshal_select,
@@ -1865,11 +1865,11 @@ class Minio(object):
         is_non_empty_string(upload_id)
 
         # Order uploaded parts as required by S3 specification
-        ordered_parts = []
-        for part in sorted(uploaded_parts.keys()):
-            ordered_parts.append(uploaded_parts[part])
+        part_numbers = sorted(uploaded_parts.keys())
+        etags = [uploaded_parts[part].etag for part in part_numbers]
 
-        data = xml_marshal_complete_multipart_upload(ordered_parts)
+        data = xml_marshal_complete_multipart_upload_etags(part_numbers,
+                                                           etags)
         sha256_hex = get_sha256_hexdigest(data)
         md5_base64 = get_md5_base64digest(data)
 
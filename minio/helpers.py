@@ -56,6 +56,21 @@ MAX_POOL_SIZE = 10
 MIN_PART_SIZE = 5 * 1024 * 1024  # 5MiB
 DEFAULT_PART_SIZE = MIN_PART_SIZE  # Currently its 5MiB
 
+NOTIFICATION_EVENTS = set([
+    's3:ObjectAccessed:*',
+    's3:ObjectAccessed:Get',
+    's3:ObjectAccessed:Head',
+    's3:ReducedRedundancyLostObject',
+    's3:ObjectCreated:*',
+    's3:ObjectCreated:Put',
+    's3:ObjectCreated:Post',
+    's3:ObjectCreated:Copy',
+    's3:ObjectCreated:CompleteMultipartUpload',
+    's3:ObjectRemoved:*',
+    's3:ObjectRemoved:Delete',
+    's3:ObjectRemoved:DeleteMarkerCreated',
+])
+
 _VALID_BUCKETNAME_REGEX = re.compile(
     '^[A-Za-z0-9][A-Za-z0-9\\.\\-\\_\\:]{1,61}[A-Za-z0-9]$')
 _VALID_BUCKETNAME_STRICT_REGEX = re.compile(
@@ -468,21 +483,6 @@ def is_valid_bucket_notification_config(notifications):
         'Filter',
     ])
 
-    NOTIFICATION_EVENTS = set([
-        's3:ObjectAccessed:*',
-        's3:ObjectAccessed:Get',
-        's3:ObjectAccessed:Head',
-        's3:ReducedRedundancyLostObject',
-        's3:ObjectCreated:*',
-        's3:ObjectCreated:Put',
-        's3:ObjectCreated:Post',
-        's3:ObjectCreated:Copy',
-        's3:ObjectCreated:CompleteMultipartUpload',
-        's3:ObjectRemoved:*',
-        's3:ObjectRemoved:Delete',
-        's3:ObjectRemoved:DeleteMarkerCreated',
-    ])
-
     for key, value in notifications.items():
         # check if key names are valid
         if key not in VALID_NOTIFICATION_KEYS:
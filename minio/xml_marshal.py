@@ -28,15 +28,94 @@ This module contains the simple wrappers for XML marshaller's.
 from __future__ import absolute_import
 import io
 
-import xml.etree.ElementTree as ET
-from collections import defaultdict
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from .helpers import NOTIFICATION_EVENTS
 
 _S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+_NS_PREFIX = '{' + _S3_NAMESPACE + '}'
+_NS_LEN = len(_NS_PREFIX)
+_NS_ATTRIB = {'xmlns': _S3_NAMESPACE}
+_NS_MARKUP = ' xmlns="' + _S3_NAMESPACE + '"'
+
+# Memo for _strip_ns, bounded so unexpected responses cannot grow it forever.
+_STRIPPED_TAGS = {}
+_STRIPPED_TAGS_MAX = 256
+
+# Memo for _escape_encoded, bounded in entry count and entry length.
+_ESCAPED_TEXT = {}
+_ESCAPED_TEXT_MAX = 1024
+_ESCAPED_TEXT_MAX_LEN = 256
+
+_CREATE_BUCKET_PREFIX = (
+    '<CreateBucketConfiguration' + _NS_MARKUP + '>'
+    '<LocationConstraint>')
+_CREATE_BUCKET_SUFFIX = '</LocationConstraint></CreateBucketConfiguration>'
+
+_DELETE_OBJECTS_CHUNK_SIZE = 4096
+
+_SSE_CONFIG_PREFIX = '<ServerSideEncryptionConfiguration>'
+_SSE_RULE_PREFIX = (
+    '<Rule><ApplyServerSideEncryptionByDefault>'
+    '<SSEAlgorithm>%s</SSEAlgorithm>')
+_SSE_KMS_MASTER_KEY_ID = '<KMSMasterKeyID>%s</KMSMasterKeyID>'
+_SSE_RULE_SUFFIX = '</ApplyServerSideEncryptionByDefault></Rule>'
+_SSE_CONFIG_SUFFIX = '</ServerSideEncryptionConfiguration>'
+
+_COMPLETE_MULTIPART_UPLOAD_PREFIX = (
+    '<CompleteMultipartUpload' + _NS_MARKUP + '>')
+_COMPLETE_MULTIPART_UPLOAD_PART = (
+    '<Part><PartNumber>%s</PartNumber><ETag>"%s"</ETag></Part>')
+_COMPLETE_MULTIPART_UPLOAD_SUFFIX = '</CompleteMultipartUpload>'
+
+_SELECT_REQUEST_PREFIX = (
+    '<SelectObjectContentRequest><Expression>%s</Expression>'
+    '<ExpressionType>SQL</ExpressionType>')
+_SELECT_INPUT_PREFIX = (
+    '<InputSerialization><CompressionType>%s</CompressionType>')
+_SELECT_CSV_INPUT = (
+    '<CSV><FileHeaderInfo>%s</FileHeaderInfo>'
+    '<RecordDelimiter>%s</RecordDelimiter>'
+    '<FieldDelimiter>%s</FieldDelimiter>'
+    '<QuoteCharacter>%s</QuoteCharacter>'
+    '<QuoteEscapeCharacter>%s</QuoteEscapeCharacter>'
+    '<Comments>%s</Comments>'
+    '<AllowQuotedRecordDelimiter>%s</AllowQuotedRecordDelimiter></CSV>')
+_SELECT_JSON_INPUT = '<JSON><Type>%s</Type></JSON>'
+_SELECT_PARQUET_INPUT = '<Parquet />'
+_SELECT_OUTPUT_PREFIX = '</InputSerialization><OutputSerialization>'
+_SELECT_CSV_OUTPUT = (
+    '<CSV><QuoteFields>%s</QuoteFields>'
+    '<RecordDelimiter>%s</RecordDelimiter>'
+    '<FieldDelimiter>%s</FieldDelimiter>'
+    '<QuoteCharacter>%s</QuoteCharacter>'
+    '<QuoteEscapeCharacter>%s</QuoteEscapeCharacter></CSV>')
+_SELECT_JSON_OUTPUT = '<JSON><RecordDelimiter>%s</RecordDelimiter></JSON>'
+_SELECT_REQUEST_SUFFIX = (
+    '</OutputSerialization>'
+    '<RequestProgress><Enabled>%s</Enabled></RequestProgress>'
+    '</SelectObjectContentRequest>')
+
+
+# Shared read-only defaults for optional notification config keys.
+_EMPTY_DICT = {}
+_EMPTY_TUPLE = ()
+
+# Encoded <Event> elements for every known notification event.
+_EVENT_MARKUP = dict(
+    (event, ('<Event>' + event + '</Event>').encode('ascii'))
+    for event in NOTIFICATION_EVENTS)
 
 
 def Element(tag, with_namespace=False):
     if with_namespace:
-        return ET.Element(tag, {'xmlns': _S3_NAMESPACE})
+        return ET.Element(tag, _NS_ATTRIB)
     return ET.Element(tag)
 
 
@@ -47,65 +126,141 @@ def SubElement(parent, tag, text=None):
     return subElement
 
 
+class _Writer(object):
+    """
+    Writes XML markup directly into a byte buffer without building a tree.
+    """
+
+    def __init__(self):
+        self._buf = io.BytesIO()
+
+    def open(self, tag, with_namespace=False):
+        if with_namespace:
+            self._buf.write(_encode_xml('<' + tag + _NS_MARKUP + '>'))
+        else:
+            self._buf.write(_encode_xml('<' + tag + '>'))
+
+    def close(self, tag):
+        self._buf.write(_encode_xml('</' + tag + '>'))
+
+    def write_encoded(self, data):
+        self._buf.write(data)
+
+    def leaf(self, tag, text):
+        self._buf.write(_encode_xml(
+            '<' + tag + '>' + escape(text) + '</' + tag + '>'))
+
+    def getvalue(self):
+        return self._buf.getvalue()
+
+
 def get_xml_data(element):
-    data = io.BytesIO()
-    ET.ElementTree(element).write(data, encoding=None, xml_declaration=False)
-    return data.getvalue()
+    # Kept for compatibility, the marshallers in this module no longer build
+    # element trees. Output is us-ascii without an XML declaration for both
+    # lxml and ElementTree, but empty elements differ: lxml writes <A/>
+    # where ElementTree writes <A />.
+    return ET.tostring(element)
+
+
+def _text(value):
+    # Escapes an optional text value; None becomes empty element content.
+    if value is None:
+        return ''
+    return escape(value)
+
+
+def _encode_xml(text):
+    # Same encoding as get_xml_data: non-ascii characters become character
+    # references.
+    return text.encode('ascii', 'xmlcharrefreplace')
+
+
+def _escape_encoded(text):
+    # Escapes and encodes a text value. Short values such as filter rule
+    # names and prefixes repeat across configurations, so they are memoized.
+    data = _ESCAPED_TEXT.get(text)
+    if data is None:
+        data = _encode_xml(escape(text))
+        if (len(text) <= _ESCAPED_TEXT_MAX_LEN and
+                len(_ESCAPED_TEXT) < _ESCAPED_TEXT_MAX):
+            _ESCAPED_TEXT[text] = data
+    return data
 
 
 def xml_to_dict(in_xml):
-    # Converts xml to dict
-    elem = ET.XML(in_xml)
+    # Converts xml to dict. Responses are always parsed with ElementTree,
+    # whose expat parser drops comments and processing instructions and
+    # never loads external entities, so results do not depend on whether
+    # lxml is installed.
+    elem = ElementTree.fromstring(in_xml)
     return etree_to_dict(elem)
 
 
+def _strip_ns(tag):
+    # Strips the S3 namespace from a tag, leaving other namespaces intact.
+    # Responses reuse a small set of tags, so results are memoized.
+    stripped = _STRIPPED_TAGS.get(tag)
+    if stripped is None:
+        if tag.startswith(_NS_PREFIX):
+            stripped = tag[_NS_LEN:]
+        else:
+            stripped = tag
+        if len(_STRIPPED_TAGS) < _STRIPPED_TAGS_MAX:
+            _STRIPPED_TAGS[tag] = stripped
+    return stripped
+
+
 def etree_to_dict(elem):
     # Converts ElementTree object to dict
-    ns = '{' + _S3_NAMESPACE + '}'
-    elem.tag = elem.tag.replace(ns, '')
-
-    d = {elem.tag: {} if elem.attrib else None}
-    children = list(elem)
-    if children:
-        dd = defaultdict(list)
-        if children[0].tag.replace(ns, '') == 'Rule':
-            for dc in map(etree_to_dict, children):
-                for k, v in dc.items():
-                    dd[k].append([v])
-        else:
-            for dc in map(etree_to_dict, children):
-                for k, v in dc.items():
-                    dd[k].append(v)
-        d = {elem.tag: {k: v[0] if len(v) == 1 else v for k, v in dd.items()}}
-    if elem.attrib:
-        d[elem.tag].update(('@' + k, v) for k, v in elem.attrib.items())
-    if elem.text:
-        text = elem.text.strip()
-        if children or elem.attrib:
-            if text:
-                d[elem.tag]['#text'] = text
+    tag = _strip_ns(elem.tag)
+    attrib = elem.attrib
+    text = elem.text
+
+    # Fast path for the most common node, a leaf without attributes.
+    if not attrib and len(elem) == 0:
+        return {tag: text.strip() if text else None}
+
+    # Past the fast path the node has children, attributes or both, so its
+    # value is always a dict. Children are iterated in place, not copied.
+    if len(elem):
+        dd = {}
+        if _strip_ns(elem[0].tag) == 'Rule':
+            for child in elem:
+                for k, v in etree_to_dict(child).items():
+                    dd.setdefault(k, []).append([v])
         else:
-            d[elem.tag] = text
-    return d
+            for child in elem:
+                for k, v in etree_to_dict(child).items():
+                    dd.setdefault(k, []).append(v)
+        value = {k: v[0] if len(v) == 1 else v for k, v in dd.items()}
+    else:
+        value = {}
+
+    if attrib:
+        value.update(('@' + k, v) for k, v in attrib.items())
+    if text:
+        text = text.strip()
+        if text:
+            value['#text'] = text
+    return {tag: value}
 
 
 def xml_marshal_bucket_encryption(rules):
-    root = Element('ServerSideEncryptionConfiguration')
+    parts = [_SSE_CONFIG_PREFIX]
 
     if rules:
         # As server supports only one rule, the first rule is taken due to
         # no validation is done at server side.
-        apply_element = SubElement(SubElement(root, 'Rule'),
-                                   'ApplyServerSideEncryptionByDefault')
-        SubElement(apply_element, 'SSEAlgorithm',
-                   rules[0]['ApplyServerSideEncryptionByDefault'].get(
-                       'SSEAlgorithm', 'AES256'))
-        kms_text = rules[0]['ApplyServerSideEncryptionByDefault'].get(
-            'KMSMasterKeyID')
+        apply_config = rules[0]['ApplyServerSideEncryptionByDefault']
+        parts.append(_SSE_RULE_PREFIX %
+                     _text(apply_config.get('SSEAlgorithm', 'AES256')))
+        kms_text = apply_config.get('KMSMasterKeyID')
         if kms_text:
-            SubElement(apply_element, 'KMSMasterKeyID', kms_text)
+            parts.append(_SSE_KMS_MASTER_KEY_ID % _text(kms_text))
+        parts.append(_SSE_RULE_SUFFIX)
 
-    return get_xml_data(root)
+    parts.append(_SSE_CONFIG_SUFFIX)
+    return _encode_xml(''.join(parts))
 
 
 def xml_marshal_bucket_constraint(region):
@@ -115,61 +270,51 @@ def xml_marshal_bucket_constraint(region):
     :param region: Region name of a given bucket.
     :return: Marshalled XML data.
     """
-    root = Element('CreateBucketConfiguration', with_namespace=True)
-    SubElement(root, 'LocationConstraint', region)
-    return get_xml_data(root)
+    return _encode_xml(_CREATE_BUCKET_PREFIX + escape(region) +
+                       _CREATE_BUCKET_SUFFIX)
 
 
 def xml_marshal_select(opts):
-    root = Element('SelectObjectContentRequest')
-    SubElement(root, 'Expression', opts.expression)
-    SubElement(root, 'ExpressionType', 'SQL')
-
-    input_serialization = SubElement(root, 'InputSerialization')
-    SubElement(input_serialization, 'CompressionType',
-               opts.in_ser.compression_type)
-
-    if opts.in_ser.csv_input:
-        csv = SubElement(input_serialization, 'CSV')
-        SubElement(csv, 'FileHeaderInfo', opts.in_ser.csv_input.FileHeaderInfo)
-        SubElement(csv, 'RecordDelimiter',
-                   opts.in_ser.csv_input.RecordDelimiter)
-        SubElement(csv, 'FieldDelimiter', opts.in_ser.csv_input.FieldDelimiter)
-        SubElement(csv, 'QuoteCharacter', opts.in_ser.csv_input.QuoteCharacter)
-        SubElement(csv, 'QuoteEscapeCharacter',
-                   opts.in_ser.csv_input.QuoteEscapeCharacter)
-        SubElement(csv, 'Comments', opts.in_ser.csv_input.Comments)
-        SubElement(csv, 'AllowQuotedRecordDelimiter',
-                   opts.in_ser.csv_input.AllowQuotedRecordDelimiter.lower())
+    # The request has a fixed shape per input/output format, so each
+    # section is filled into a template instead of building a tree.
+    parts = [_SELECT_REQUEST_PREFIX % _text(opts.expression),
+             _SELECT_INPUT_PREFIX % _text(opts.in_ser.compression_type)]
+
+    csv_input = opts.in_ser.csv_input
+    if csv_input:
+        parts.append(_SELECT_CSV_INPUT % (
+            _text(csv_input.FileHeaderInfo),
+            _text(csv_input.RecordDelimiter),
+            _text(csv_input.FieldDelimiter),
+            _text(csv_input.QuoteCharacter),
+            _text(csv_input.QuoteEscapeCharacter),
+            _text(csv_input.Comments),
+            _text(csv_input.AllowQuotedRecordDelimiter.lower())))
 
     if opts.in_ser.json_input:
-        SubElement(SubElement(input_serialization, 'JSON'), 'Type',
-                   opts.in_ser.json_input.Type)
+        parts.append(_SELECT_JSON_INPUT % _text(opts.in_ser.json_input.Type))
 
     if opts.in_ser.parquet_input:
-        SubElement(input_serialization, 'Parquet')
-
-    output_serialization = SubElement(root, 'OutputSerialization')
-    if opts.out_ser.csv_output:
-        csv = SubElement(output_serialization, 'CSV')
-        SubElement(csv, 'QuoteFields', opts.out_ser.csv_output.QuoteFields)
-        SubElement(csv, 'RecordDelimiter',
-                   opts.out_ser.csv_output.RecordDelimiter)
-        SubElement(csv, 'FieldDelimiter',
-                   opts.out_ser.csv_output.FieldDelimiter)
-        SubElement(csv, 'QuoteCharacter',
-                   opts.out_ser.csv_output.QuoteCharacter)
-        SubElement(csv, 'QuoteEscapeCharacter',
-                   opts.out_ser.csv_output.QuoteEscapeCharacter)
+        parts.append(_SELECT_PARQUET_INPUT)
+
+    parts.append(_SELECT_OUTPUT_PREFIX)
+    csv_output = opts.out_ser.csv_output
+    if csv_output:
+        parts.append(_SELECT_CSV_OUTPUT % (
+            _text(csv_output.QuoteFields),
+            _text(csv_output.RecordDelimiter),
+            _text(csv_output.FieldDelimiter),
+            _text(csv_output.QuoteCharacter),
+            _text(csv_output.QuoteEscapeCharacter)))
 
     if opts.out_ser.json_output:
-        SubElement(SubElement(output_serialization, 'JSON'), 'RecordDelimiter',
-                   opts.out_ser.json_output.RecordDelimiter)
+        parts.append(_SELECT_JSON_OUTPUT %
+                     _text(opts.out_ser.json_output.RecordDelimiter))
 
-    SubElement(SubElement(root, 'RequestProgress'), 'Enabled',
-               opts.req_progress.enabled.lower())
+    parts.append(_SELECT_REQUEST_SUFFIX %
+                 _text(opts.req_progress.enabled.lower()))
 
-    return get_xml_data(root)
+    return _encode_xml(''.join(parts))
 
 
 def xml_marshal_complete_multipart_upload(uploaded_parts):
@@ -179,13 +324,35 @@ def xml_marshal_complete_multipart_upload(uploaded_parts):
     :param uploaded_parts: List of all uploaded parts, ordered by part number.
     :return: Marshalled XML data.
     """
-    root = Element('CompleteMultipartUpload', with_namespace=True)
+    part_numbers = []
+    etags = []
     for uploaded_part in uploaded_parts:
-        part = SubElement(root, 'Part')
-        SubElement(part, 'PartNumber', str(uploaded_part.part_number))
-        SubElement(part, 'ETag', '"' + uploaded_part.etag + '"')
+        part_numbers.append(uploaded_part.part_number)
+        etags.append(uploaded_part.etag)
+    return xml_marshal_complete_multipart_upload_etags(part_numbers, etags)
+
+
+def xml_marshal_complete_multipart_upload_etags(part_numbers, etags):
+    """
+    Marshal's complete multipart upload request based on parallel lists
+    of *part_numbers* and their *etags*.
 
-    return get_xml_data(root)
+    :param part_numbers: List of all uploaded part numbers, in order.
+    :param etags: List of ETags matching *part_numbers*.
+    :return: Marshalled XML data.
+    """
+    if len(part_numbers) != len(etags):
+        raise ValueError('part_numbers and etags must have the same length, '
+                         'got {0} and {1}'.format(len(part_numbers),
+                                                  len(etags)))
+
+    # The document has a fixed shape and part numbers/ETags never need
+    # escaping, so it is formatted directly instead of building a tree.
+    parts = [_COMPLETE_MULTIPART_UPLOAD_PREFIX]
+    parts.extend(_COMPLETE_MULTIPART_UPLOAD_PART % part
+                 for part in zip(part_numbers, etags))
+    parts.append(_COMPLETE_MULTIPART_UPLOAD_SUFFIX)
+    return ''.join(parts).encode('ascii')
 
 
 def xml_marshal_bucket_notifications(notifications):
@@ -256,24 +423,17 @@ def xml_marshal_bucket_notifications(notifications):
 
     :return: Marshalled XML data
     """
-    root = Element('NotificationConfiguration', with_namespace=True)
-    _add_notification_config_to_xml(
-        root,
-        'TopicConfiguration',
-        notifications.get('TopicConfigurations', [])
-    )
-    _add_notification_config_to_xml(
-        root,
-        'QueueConfiguration',
-        notifications.get('QueueConfigurations', [])
-    )
-    _add_notification_config_to_xml(
-        root,
-        'CloudFunctionConfiguration',
-        notifications.get('CloudFunctionConfigurations', [])
-    )
-
-    return get_xml_data(root)
+    writer = _Writer()
+    writer.open('NotificationConfiguration', with_namespace=True)
+    _add_topic_configs_to_xml(
+        writer, notifications.get('TopicConfigurations', []))
+    _add_queue_configs_to_xml(
+        writer, notifications.get('QueueConfigurations', []))
+    _add_cloud_function_configs_to_xml(
+        writer, notifications.get('CloudFunctionConfigurations', []))
+    writer.close('NotificationConfiguration')
+
+    return writer.getvalue()
 
 
 NOTIFICATIONS_ARN_FIELDNAME_MAP = {
@@ -283,33 +443,61 @@ NOTIFICATIONS_ARN_FIELDNAME_MAP = {
 }
 
 
-def _add_notification_config_to_xml(node, element_name, configs):
+def _notification_config_marshaller(element_name):
     """
-    Internal function that builds the XML sub-structure for a given
-    kind of notification configuration.
+    Internal function that returns a function writing the XML
+    sub-structure for a given kind of notification configuration, with
+    its element and ARN tags resolved up front.
 
     """
-    for config in configs:
-        config_node = SubElement(node, element_name)
-
-        if 'Id' in config:
-            SubElement(config_node, 'Id', config['Id'])
-
-        SubElement(config_node, NOTIFICATIONS_ARN_FIELDNAME_MAP[element_name],
-                   config['Arn'])
-
-        for event in config['Events']:
-            SubElement(config_node, 'Event', event)
-
-        filter_rules = config.get('Filter', {}).get(
-            'Key', {}).get('FilterRules', [])
-        if filter_rules:
-            s3key_node = SubElement(SubElement(config_node, 'Filter'), 'S3Key')
-            for filter_rule in filter_rules:
-                filter_rule_node = SubElement(s3key_node, 'FilterRule')
-                SubElement(filter_rule_node, 'Name', filter_rule['Name'])
-                SubElement(filter_rule_node, 'Value', filter_rule['Value'])
-    return node
+    config_open = ('<' + element_name + '>').encode('ascii')
+    config_close = ('</' + element_name + '>').encode('ascii')
+    arn_tag = NOTIFICATIONS_ARN_FIELDNAME_MAP[element_name]
+    arn_open = ('<' + arn_tag + '>').encode('ascii')
+    arn_close = ('</' + arn_tag + '>').encode('ascii')
+
+    def add_configs_to_xml(writer, configs):
+        for config in configs:
+            writer.write_encoded(config_open)
+
+            if 'Id' in config:
+                writer.write_encoded(
+                    b'<Id>' + _encode_xml(escape(config['Id'])) + b'</Id>')
+
+            writer.write_encoded(
+                arn_open + _encode_xml(escape(config['Arn'])) + arn_close)
+
+            for event in config['Events']:
+                markup = _EVENT_MARKUP.get(event)
+                if markup is None:
+                    writer.leaf('Event', event)
+                else:
+                    writer.write_encoded(markup)
+
+            filter_rules = config.get('Filter', _EMPTY_DICT).get(
+                'Key', _EMPTY_DICT).get('FilterRules', _EMPTY_TUPLE)
+            if filter_rules:
+                writer.write_encoded(b'<Filter><S3Key>')
+                for filter_rule in filter_rules:
+                    writer.write_encoded(
+                        b'<FilterRule><Name>' +
+                        _escape_encoded(filter_rule['Name']) +
+                        b'</Name><Value>' +
+                        _escape_encoded(filter_rule['Value']) +
+                        b'</Value></FilterRule>')
+                writer.write_encoded(b'</S3Key></Filter>')
+
+            writer.write_encoded(config_close)
+
+    return add_configs_to_xml
+
+
+_add_topic_configs_to_xml = _notification_config_marshaller(
+    'TopicConfiguration')
+_add_queue_configs_to_xml = _notification_config_marshaller(
+    'QueueConfiguration')
+_add_cloud_function_configs_to_xml = _notification_config_marshaller(
+    'CloudFunctionConfiguration')
 
 
 def xml_marshal_delete_objects(object_names):
@@ -319,15 +507,34 @@ def xml_marshal_delete_objects(object_names):
     :param object_names: List of object keys to be deleted.
     :return: Serialized XML string for multi-object delete request body.
     """
-    root = Element('Delete')
+    return b''.join(xml_marshal_delete_objects_iter(object_names))
+
 
+def xml_marshal_delete_objects_iter(object_names):
+    """
+    Marshal Multi-Object Delete request body from object names, yielding
+    it in chunks of roughly 4KiB.
+
+    :param object_names: Iterable of object keys to be deleted.
+    :return: Generator of serialized XML chunks.
+    """
     # use quiet mode in the request - this causes the S3 Server to
     # limit its response to only object keys that had errors during
     # the delete operation.
-    SubElement(root, 'Quiet', "true")
+    yield b'<Delete><Quiet>true</Quiet>'
 
     # add each object to the request.
+    chunk = []
+    size = 0
     for object_name in object_names:
-        SubElement(SubElement(root, 'Object'), 'Key', object_name)
-
-    return get_xml_data(root)
+        fragment = '<Object><Key>' + escape(object_name) + '</Key></Object>'
+        chunk.append(fragment)
+        size += len(fragment)
+        if size >= _DELETE_OBJECTS_CHUNK_SIZE:
+            yield _encode_xml(''.join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        yield _encode_xml(''.join(chunk))
+
+    yield b'</Delete>'
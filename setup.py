@@ -20,8 +20,18 @@ from codecs import open
 
 try:
     from setuptools import setup
+    from setuptools.command.build_ext import build_ext
 except ImportError:
     from distutils.core import setup
+    from distutils.command.build_ext import build_ext
+
+from distutils.errors import (CCompilerError, DistutilsExecError,
+                              DistutilsPlatformError)
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
 
 if sys.argv[-1] == 'publish':
     os.system('python setup.py sdist upload')
@@ -50,6 +60,45 @@ requires = [
     'configparser',
 ]
 
+
+class optional_build_ext(build_ext):
+    """
+    Builds extensions if possible, falling back to the pure Python modules
+    when no working compiler is available.
+    """
+
+    _ERRORS = (CCompilerError, DistutilsExecError, DistutilsPlatformError)
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except self._ERRORS as exc:
+            self._warn(exc)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except self._ERRORS as exc:
+            self._warn(exc)
+
+    def _warn(self, exc):
+        sys.stderr.write('WARNING: building C extensions failed ({0}), '
+                         'using pure Python modules\n'.format(exc))
+
+
+# XML marshallers are compiled only on request, by setting MINIO_CYTHON=1
+# with Cython installed. The default build stays pure Python so that the
+# universal wheel is published. Only commands that build the package
+# cythonize, so e.g. sdist and nosetests do not generate C sources.
+_BUILD_COMMANDS = set(['build', 'build_ext', 'install', 'develop', 'bdist',
+                       'bdist_egg', 'bdist_wheel', 'editable_wheel'])
+
+ext_modules = []
+if (os.environ.get('MINIO_CYTHON') == '1' and cythonize is not None and
+        _BUILD_COMMANDS.intersection(sys.argv[1:])):
+    ext_modules = cythonize(['minio/xml_marshal.py'],
+                            compiler_directives={'language_level': 3})
+
 tests_requires = [
     'nose',
     'mock',
@@ -68,6 +117,8 @@ setup(
     package_dir={'minio': 'minio'},
     packages=packages,
     install_requires=requires,
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': optional_build_ext},
     tests_require=tests_requires,
     license='Apache License 2.0',
     classifiers=[
@@ -15,18 +15,27 @@
 # limitations under the License.
 
 from unittest import TestCase
-from nose.tools import eq_
+from nose.tools import eq_, ok_, raises
 
 from minio.definitions import UploadPart
-from minio.xml_marshal import (xml_marshal_bucket_constraint,
+from minio.xml_marshal import (Element, SubElement, get_xml_data,
+                               xml_marshal_bucket_constraint,
                                xml_marshal_complete_multipart_upload,
-                               xml_marshal_select)
+                               xml_marshal_complete_multipart_upload_etags,
+                               xml_marshal_bucket_encryption,
+                               xml_marshal_bucket_notifications,
+                               xml_marshal_delete_objects,
+                               xml_marshal_delete_objects_iter,
+                               xml_marshal_select,
+                               xml_to_dict)
 from minio.select.options import (SelectObjectOptions,
                                   CSVInput,
+                                  JSONInput,
                                   RequestProgress,
                                   InputSerialization,
                                   OutputSerialization,
-                                  CSVOutput)
+                                  CSVOutput,
+                                  JsonOutput)
 
 class GenerateRequestTest(TestCase):
     def test_generate_bucket_constraint(self):
@@ -55,6 +64,89 @@ class GenerateRequestTest(TestCase):
         actual_string = xml_marshal_complete_multipart_upload(etags)
         eq_(expected_string, actual_string)
 
+        actual_string = xml_marshal_complete_multipart_upload_etags(
+            [part.part_number for part in etags],
+            [part.etag for part in etags])
+        eq_(expected_string, actual_string)
+
+        actual_string = xml_marshal_complete_multipart_upload(
+            part for part in etags)
+        eq_(expected_string, actual_string)
+
+        actual_string = xml_marshal_complete_multipart_upload_etags(
+            ['1', '2', '3'], [part.etag for part in etags])
+        eq_(expected_string, actual_string)
+
+    @raises(ValueError)
+    def test_generate_complete_multipart_upload_length_mismatch(self):
+        xml_marshal_complete_multipart_upload_etags(
+            [1, 2], ['a54357aff0632cce46d942af68356b38'])
+
+    def test_xml_marshal_bucket_encryption(self):
+        expected_string = b'<ServerSideEncryptionConfiguration><Rule>' \
+                          b'<ApplyServerSideEncryptionByDefault><SSEAlgorithm>aws:kms</SSEAlgorithm>' \
+                          b'<KMSMasterKeyID>arn:aws:kms:key&amp;1</KMSMasterKeyID>' \
+                          b'</ApplyServerSideEncryptionByDefault></Rule></ServerSideEncryptionConfiguration>'
+        rules = [{
+            'ApplyServerSideEncryptionByDefault': {
+                'SSEAlgorithm': 'aws:kms',
+                'KMSMasterKeyID': 'arn:aws:kms:key&1'
+            }
+        }]
+        actual_string = xml_marshal_bucket_encryption(rules)
+        eq_(expected_string, actual_string)
+
+    def test_xml_marshal_bucket_notifications(self):
+        expected_string = b'<NotificationConfiguration xmlns="http://s3.amazonaws.com/doc/2006-03-01/">' \
+                          b'<QueueConfiguration><Id>1</Id><Queue>arn1</Queue>' \
+                          b'<Event>s3:ObjectCreated:*</Event><Event>s3:ObjectRemoved:*</Event>' \
+                          b'<Filter><S3Key><FilterRule><Name>prefix</Name><Value>abc&amp;</Value></FilterRule>' \
+                          b'</S3Key></Filter></QueueConfiguration>' \
+                          b'<CloudFunctionConfiguration><CloudFunction>arn2</CloudFunction>' \
+                          b'<Event>s3:ObjectCreated:Put</Event></CloudFunctionConfiguration>' \
+                          b'</NotificationConfiguration>'
+        notifications = {
+            'QueueConfigurations': [
+                {
+                    'Id': '1',
+                    'Arn': 'arn1',
+                    'Events': ['s3:ObjectCreated:*', 's3:ObjectRemoved:*'],
+                    'Filter': {
+                        'Key': {
+                            'FilterRules': [
+                                {'Name': 'prefix', 'Value': 'abc&'}
+                            ]
+                        }
+                    }
+                }
+            ],
+            'CloudFunctionConfigurations': [
+                {
+                    'Arn': 'arn2',
+                    'Events': ['s3:ObjectCreated:Put'],
+                }
+            ]
+        }
+        actual_string = xml_marshal_bucket_notifications(notifications)
+        eq_(expected_string, actual_string)
+
+    def test_xml_marshal_delete_objects(self):
+        expected_string = b'<Delete><Quiet>true</Quiet>' \
+                          b'<Object><Key>a&lt;b&gt;&amp;c</Key></Object>' \
+                          b'<Object><Key>r&#233;sum&#233;.txt</Key></Object>' \
+                          b'</Delete>'
+        actual_string = xml_marshal_delete_objects(['a<b>&c',
+                                                    u'r\xe9sum\xe9.txt'])
+        eq_(expected_string, actual_string)
+
+    def test_xml_marshal_delete_objects_iter(self):
+        object_names = ['object-%d' % i for i in range(1000)]
+        chunks = list(xml_marshal_delete_objects_iter(iter(object_names)))
+        ok_(len(chunks) > 3)
+        eq_(b'<Delete><Quiet>true</Quiet>', chunks[0])
+        eq_(b'</Delete>', chunks[-1])
+        eq_(xml_marshal_delete_objects(object_names), b''.join(chunks))
+
     def test_xml_marshal_select(self):
         expected_string = b'<SelectObjectContentRequest><Expression>select * from s3object</Expression>' \
                           b'<ExpressionType>SQL</ExpressionType><InputSerialization>' \
@@ -94,3 +186,63 @@ class GenerateRequestTest(TestCase):
             )
         actual_string = xml_marshal_select(options)
         eq_(expected_string, actual_string)
+
+    def test_xml_marshal_select_escapes_and_encodes_text(self):
+        expected_string = b'<SelectObjectContentRequest>' \
+                          b'<Expression>select * from s3object s where s.name = \'caf&#233;\' ' \
+                          b'and s.size &lt; 10</Expression>' \
+                          b'<ExpressionType>SQL</ExpressionType><InputSerialization>' \
+                          b'<CompressionType>NONE</CompressionType>' \
+                          b'<JSON><Type>DOCUMENT</Type></JSON></InputSerialization>' \
+                          b'<OutputSerialization><JSON><RecordDelimiter>\n</RecordDelimiter></JSON>' \
+                          b'</OutputSerialization>' \
+                          b'<RequestProgress><Enabled>false</Enabled></RequestProgress></SelectObjectContentRequest>'
+
+        options = SelectObjectOptions(
+            expression=u"select * from s3object s where s.name = 'caf\xe9' "
+                       u"and s.size < 10",
+            input_serialization=InputSerialization(
+                json=JSONInput(Type="DOCUMENT")),
+            output_serialization=OutputSerialization(
+                json=JsonOutput(RecordDelimiter="\n")),
+            request_progress=RequestProgress(enabled="FALSE")
+            )
+        actual_string = xml_marshal_select(options)
+        eq_(expected_string, actual_string)
+
+    def test_get_xml_data(self):
+        root = Element('CreateBucketConfiguration', with_namespace=True)
+        SubElement(root, 'LocationConstraint', u'caf\xe9 & <co>')
+        expected_string = b'<CreateBucketConfiguration xmlns="http://s3.amazonaws.com/doc/2006-03-01/">' \
+                          b'<LocationConstraint>caf&#233; &amp; &lt;co&gt;</LocationConstraint>' \
+                          b'</CreateBucketConfiguration>'
+        eq_(expected_string, get_xml_data(root))
+
+    def test_xml_to_dict(self):
+        response = u'<?xml version="1.0" encoding="UTF-8"?>\n' \
+                   u'<ServerSideEncryptionConfiguration ' \
+                   u'xmlns="http://s3.amazonaws.com/doc/2006-03-01/">' \
+                   u'<Rule><ApplyServerSideEncryptionByDefault>' \
+                   u'<SSEAlgorithm>AES256</SSEAlgorithm>' \
+                   u'</ApplyServerSideEncryptionByDefault></Rule>' \
+                   u'</ServerSideEncryptionConfiguration>'
+        expected = {
+            'ServerSideEncryptionConfiguration': {
+                'Rule': [{
+                    'ApplyServerSideEncryptionByDefault': {
+                        'SSEAlgorithm': 'AES256'
+                    }
+                }]
+            }
+        }
+        eq_(expected, xml_to_dict(response))
+        eq_(expected, xml_to_dict(response.encode('utf-8')))
+
+    def test_xml_to_dict_ignores_comments(self):
+        response = '<?xml version="1.0" encoding="UTF-8"?>' \
+                   '<A><!-- comment --><B>1</B><?pi data?><C>2</C></A>'
+        eq_({'A': {'B': '1', 'C': '2'}}, xml_to_dict(response))
+
+    def test_xml_to_dict_expands_internal_entities(self):
+        response = '<!DOCTYPE A [<!ENTITY e "X">]><A><B>a&e;b</B></A>'
+        eq_({'A': {'B': 'aXb'}}, xml_to_dict(response))